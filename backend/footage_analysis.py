@@ -1,16 +1,29 @@
 #!/usr/bin/env python3
 import os
+import re
+import asyncio
 import json
 import shutil
-import moviepy.editor as mp
-import whisper
+import queue
+import threading
+import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+import ctranslate2
+from faster_whisper import BatchedInferencePipeline, WhisperModel
 from pathlib import Path
 import dotenv
+import numpy as np
+from ahocorasick import Automaton
 import time
 import sys
 
 # Import LLM client
 from llama_stack_client import LlamaStackClient
+try:
+    from llama_stack_client import AsyncLlamaStackClient
+except ImportError:
+    AsyncLlamaStackClient = None
 
 # Load environment variables
 dotenv.load_dotenv()
@@ -19,6 +32,15 @@ sys.stdout.reconfigure(line_buffering=True)
 
 # Constants
 CHUNK_DURATION = 300  # 5 minutes in seconds
+CHUNK_QUEUE_SIZE = 2  # chunks decoded ahead of Whisper
+SAMPLE_RATE = 16000  # Whisper's expected input rate
+SILENCE_THRESHOLD_DB = -50  # 30 ms frames with an RMS below this count as silence
+WHISPER_BATCH_SIZE = 8  # 30-second windows encoded per forward pass
+LLM_CONCURRENCY = 8  # chat completions in flight when batch inference is unavailable
+WHISPER_MODEL_SIZE = os.getenv("WHISPER_MODEL", "tiny")
+_DONE = object()  # end-of-stream marker for pipeline queues
+_whisper_models = {}  # loaded Whisper models, kept for the life of the process
+_whisper_models_lock = threading.Lock()
 SYSTEM_PROMPT = """
 You are an AI that analyzes incidents in bodycam transcriptions.
 You will be given audio transcripts from police body cameras.
@@ -26,128 +48,412 @@ If you recognize events that constitute conflict, altercations, or concerning po
 summarize it and flag it for manual review. Be concise but include all relevant details.
 If the transcription contains nothing of note and just normal stanard patroling, simply state that there are no incidents!
 """
-
-def create_llama_client():
-    return LlamaStackClient(
-        base_url=f"http://llama-stack:{os.getenv('LLAMA_STACK_PORT')}"
+# Shared, byte-identical prefix of every request so the server can reuse its cached KV
+_SYSTEM_MESSAGE = {"role": "system", "content": SYSTEM_PROMPT}
+NO_INCIDENT_SUMMARY = "No incidents."
+_NEGATIVE_RE = re.compile(r"no incidents?|nothing of note", re.IGNORECASE)
+# Cheap first pass: a single greedy token decides whether a chunk needs a full summary
+CLASSIFY_PROMPT = "Does this transcript contain anything that should be flagged for manual review? Answer with a single letter: Y or N."
+CLASSIFY_SAMPLING_PARAMS = {"strategy": {"type": "greedy"}, "max_tokens": 1}
+# Chunks whose transcript contains none of these are reported as quiet without asking the LLM
+INCIDENT_LEXICON = [
+    "gun", "guns", "weapon", "weapons", "knife", "knives", "shoot", "shooting", "shot", "shots",
+    "fire", "fired", "taser", "tase", "tased", "pepper spray",
+    "fight", "fighting", "punch", "punched", "kick", "kicked", "choke", "choking", "hurt", "hurting",
+    "bleed", "bleeding", "blood", "kill", "killed", "die", "dying", "ambulance",
+    "stop", "stopped", "hands up", "show me your hands", "get down", "on the ground", "drop it", "back up",
+    "don't move", "get out", "let go", "resist", "resisting", "comply", "arrest", "arrested", "under arrest",
+    "cuff", "cuffs", "handcuff", "handcuffs", "detain", "detained", "warrant", "search", "lawyer", "my rights",
+    "help", "fuck", "fucking", "shit", "bitch", "asshole", "damn",
+]
+
+def _build_incident_automaton():
+    automaton = Automaton()
+    for phrase in INCIDENT_LEXICON:
+        automaton.add_word(phrase, phrase)
+    automaton.make_automaton()
+    return automaton
+
+_INCIDENT_AUTOMATON = _build_incident_automaton()
+
+def llama_client_settings():
+    return {
+        "base_url": f"http://llama-stack:{os.getenv('LLAMA_STACK_PORT')}"
+    }
+
+def create_llama_client(settings=None):
+    return LlamaStackClient(**(settings or llama_client_settings()))
+
+def create_async_llama_client(settings=None):
+    # Built per event loop from the same settings as the sync client, since its connections are loop-bound
+    return AsyncLlamaStackClient(**(settings or llama_client_settings()))
+
+def probe_duration(video_path):
+    result = subprocess.run(
+        ["ffprobe", "-v", "error", "-show_entries", "format=duration",
+         "-of", "default=noprint_wrappers=1:nokey=1", video_path],
+        capture_output=True, text=True, check=True
     )
-
-def extract_chunks(video_path):
+    return int(float(result.stdout.strip()))
+
+def load_whisper_model(model_size=WHISPER_MODEL_SIZE):
+    with _whisper_models_lock:
+        if model_size not in _whisper_models:
+            if ctranslate2.get_cuda_device_count() > 0:
+                device, compute_type, cpu_threads = "cuda", "int8_float16", 0
+            else:
+                # CTranslate2 only uses 4 threads by default, spread inference over every core instead
+                device, compute_type, cpu_threads = "cpu", "int8", os.cpu_count() or 0
+            print(f"Loading Whisper model ({model_size}) on {device} ({compute_type})...")
+            _whisper_models[model_size] = WhisperModel(
+                model_size, device=device, compute_type=compute_type, cpu_threads=cpu_threads
+            )
+        return _whisper_models[model_size]
+
+def _iter_queue(q):
+    while True:
+        item = q.get()
+        if item is _DONE:
+            return
+        if isinstance(item, Exception):
+            raise item
+        yield item
+
+def extract_chunks(video_path, chunk_queue, stop):
     print(f"Processing video: {video_path}")
-    clip = mp.VideoFileClip(video_path)
-    duration = int(clip.duration)
-    print(f"Video duration: {duration} seconds")
+    try:
+        # Decode the audio once, straight to the 16 kHz mono PCM Whisper consumes, and read it off the pipe
+        print(f"Extracting {CHUNK_DURATION // 60}-minute chunks...")
+        process = subprocess.Popen(
+            ["ffmpeg", "-v", "error", "-i", video_path, "-vn", "-ac", "1", "-ar", str(SAMPLE_RATE),
+             "-f", "f32le", "-"],
+            stdout=subprocess.PIPE
+        )
 
-    temp_dir = Path("temp")
-    temp_dir.mkdir(exist_ok=True)
-    print(f"Using temporary directory: {temp_dir.resolve()}")
+        chunk_bytes = CHUNK_DURATION * SAMPLE_RATE * 4  # float32 samples
+        idx = 0
+        while not stop.is_set():
+            buf = process.stdout.read(chunk_bytes)
+            if not buf:
+                break
+            # ffmpeg already emits Whisper's float32 format, so the buffer is used without conversion
+            audio = np.frombuffer(buf, np.float32)
+            chunk_name = f"chunk_{idx:03d}"
+            start = idx * CHUNK_DURATION
+            chunk_queue.put((chunk_name, audio, start))
+            print(f"Extracted chunk: {chunk_name} (starts at {start}s)")
+            idx += 1
+
+        if stop.is_set():
+            process.kill()
+        process.stdout.close()
+        process.wait()
+        if process.returncode != 0 and not stop.is_set():
+            raise RuntimeError(f"ffmpeg exited with code {process.returncode}")
+    except Exception as e:
+        chunk_queue.put(e)
+    finally:
+        chunk_queue.put(_DONE)
+
+def is_silent(audio):
+    frame_size = SAMPLE_RATE * 30 // 1000
+    frames = audio[:len(audio) // frame_size * frame_size].reshape(-1, frame_size)
+    if not len(frames):
+        return True
+    rms = np.sqrt(np.mean(np.square(frames), axis=1))
+    # Skip Whisper only when the whole chunk is silence; any audible frame could be speech
+    return not (rms > 10 ** (SILENCE_THRESHOLD_DB / 20)).any()
+
+def transcribe_chunks(chunk_queue, transcript_queue, stop, model):
+    try:
+        pipeline = BatchedInferencePipeline(model=model)
+
+        for chunk_name, audio, start_time in _iter_queue(chunk_queue):
+            if is_silent(audio):
+                print(f"Skipping silent chunk: {chunk_name} (no frame above {SILENCE_THRESHOLD_DB} dBFS)")
+                transcript_queue.put((chunk_name, "", start_time))
+                continue
+
+            print(f"Transcribing: {chunk_name}")
+            start = time.time()
+            # Segments are decoded lazily, so the text must be joined before stopping the clock
+            segments, info = pipeline.transcribe(audio, beam_size=1, batch_size=WHISPER_BATCH_SIZE)
+            text = "".join(segment.text for segment in segments)
+            end = time.time()
+            print(f"Transcription completed in {end-start:.2f} seconds")
+            transcript_queue.put((chunk_name, text, start_time))
+    except Exception as e:
+        # Stop ffmpeg and drain the chunk queue so the producer never blocks on a full queue
+        stop.set()
+        while chunk_queue.get() is not _DONE:
+            pass
+        transcript_queue.put(e)
+    finally:
+        transcript_queue.put(_DONE)
+
+def transcribe_video(video_path, whisper_model=None):
+    if whisper_model is None:
+        whisper_model = load_whisper_model()
+
+    duration = probe_duration(video_path)
+    print(f"Video duration: {duration} seconds")
 
-    audio_files = []
+    # Extraction and transcription overlap: Whisper picks up each chunk as soon as ffmpeg finishes it
+    chunk_queue = queue.Queue(maxsize=CHUNK_QUEUE_SIZE)
+    transcript_queue = queue.Queue()
+    stop = threading.Event()
 
-    for start in range(0, duration, CHUNK_DURATION):
-        end = min(start + CHUNK_DURATION, duration)
-        print(f"Extracting chunk {start//60}-{end//60} minutes...")
-        subclip = clip.subclip(start, end)
-        audio_filename = temp_dir / f"chunk_{start // 60:02d}-{end // 60:02d}.mp3"
-        subclip.audio.write_audiofile(str(audio_filename), codec='libmp3lame', verbose=False, logger=None)
-        audio_files.append((str(audio_filename), start))
-        print(f"Saved chunk: {audio_filename} (starts at {start}s)")
+    producer = threading.Thread(target=extract_chunks, args=(video_path, chunk_queue, stop), daemon=True)
+    consumer = threading.Thread(target=transcribe_chunks, args=(chunk_queue, transcript_queue, stop, whisper_model), daemon=True)
+    producer.start()
+    consumer.start()
 
-    return audio_files, str(temp_dir), duration
+    transcripts = list(_iter_queue(transcript_queue))
+    producer.join()
+    consumer.join()
 
-def transcribe_chunks(audio_files, model_size='tiny'):
-    print(f"Loading Whisper model ({model_size})...")
-    model = whisper.load_model(model_size)
-    transcripts = []
+    return transcripts, duration
 
-    for audio_path, start_time in audio_files:
-        print(f"Transcribing: {audio_path}")
-        start = time.time()
-        result = model.transcribe(audio_path)
-        end = time.time()
-        print(f"Transcription completed in {end-start:.2f} seconds")
-        transcripts.append((audio_path, result['text'], start_time))
+def _build_messages(transcript_text):
+    return [
+        _SYSTEM_MESSAGE,
+        {"role": "user", "content": f"{transcript_text}"}
+    ]
 
-    return transcripts
+def _classify_messages(transcript_text):
+    # Same prefix as the summary request, so its prefill can be reused if a summary is needed
+    return _build_messages(transcript_text) + [{"role": "user", "content": CLASSIFY_PROMPT}]
+
+def _classification(completion):
+    answer = completion.completion_message.content.strip().upper()
+    if answer.startswith("Y"):
+        return True
+    if answer.startswith("N"):
+        return False
+    return None
+
+def _quiet_chunk(chunk_start_time):
+    return {
+        "timestamp": chunk_start_time,
+        "summary": NO_INCIDENT_SUMMARY,
+        "has_incident": False
+    }
+
+def _incident_from_completion(completion, chunk_start_time, has_incident=None):
+    summary = completion.completion_message.content
+    print(f"LLM response received: {summary[:100]}...")
+
+    if has_incident is None:
+        # The classifier gave no clear answer, so judge from the summary itself
+        has_incident = _NEGATIVE_RE.search(summary) is None
+
+    return {
+        "timestamp": chunk_start_time,
+        "summary": summary,
+        "has_incident": has_incident
+    }
+
+def _analysis_error(chunk_start_time, e):
+    print(f"Error analyzing transcript: {e}")
+    return {
+        "timestamp": chunk_start_time,
+        "summary": f"Error analyzing transcript: {str(e)}",
+        "has_incident": None
+    }
+
+def _two_stage_analysis(transcript_text, chunk_start_time):
+    # Yields each chat_completion request and receives its response, so the sync and async
+    # drivers below share one copy of the classify-then-summarize logic
+    response = yield {"messages": _classify_messages(transcript_text), "sampling_params": CLASSIFY_SAMPLING_PARAMS}
+    has_incident = _classification(response)
+    if has_incident is False:
+        return _quiet_chunk(chunk_start_time)
+
+    response = yield {"messages": _build_messages(transcript_text)}
+    return _incident_from_completion(response, chunk_start_time, has_incident)
 
 def analyze_transcript(llm_client, model_id, transcript_text, chunk_start_time):
     print(f"Analyzing transcript for chunk starting at {chunk_start_time}s")
-    messages = [
-        {"role": "system", "content": SYSTEM_PROMPT},
-        {"role": "user", "content": f"{transcript_text}"}
-    ]
+    steps = _two_stage_analysis(transcript_text, chunk_start_time)
 
     try:
-        response = llm_client.inference.chat_completion(
-            model_id=model_id,
-            messages=messages
-        )
-
-        summary = response.completion_message.content
-        print(f"LLM response received: {summary[:100]}...")
-
-        has_incident = "no incident" not in summary.lower() and "nothing of note" not in summary.lower()
+        request = next(steps)
+        while True:
+            request = steps.send(llm_client.inference.chat_completion(model_id=model_id, **request))
+    except StopIteration as done:
+        return done.value
+    except Exception as e:
+        return _analysis_error(chunk_start_time, e)
 
-        return {
-            "timestamp": chunk_start_time,
-            "summary": summary
-        }
+async def analyze_transcript_async(llm_client, model_id, transcript_text, chunk_start_time):
+    print(f"Analyzing transcript for chunk starting at {chunk_start_time}s")
+    steps = _two_stage_analysis(transcript_text, chunk_start_time)
 
+    try:
+        request = next(steps)
+        while True:
+            request = steps.send(await llm_client.inference.chat_completion(model_id=model_id, **request))
+    except StopIteration as done:
+        return done.value
     except Exception as e:
-        print(f"Error analyzing transcript: {e}")
-        return {
-            "timestamp": chunk_start_time,
-            "summary": f"Error analyzing transcript: {str(e)}"
-        }
+        return _analysis_error(chunk_start_time, e)
+
+async def _analyze_transcripts_async(llm_client_settings, model_id, transcripts):
+    # Exactly LLM_CONCURRENCY requests in flight keeps the server's batcher full without flooding it
+    semaphore = asyncio.Semaphore(LLM_CONCURRENCY)
+
+    async with create_async_llama_client(llm_client_settings) as llm_client:
+        async def analyze_one(transcript_text, start_time):
+            async with semaphore:
+                return await analyze_transcript_async(llm_client, model_id, transcript_text, start_time)
+
+        return await asyncio.gather(*(
+            analyze_one(transcript_text, start_time) for _, transcript_text, start_time in transcripts
+        ))
+
+def mentions_incident(transcript_text):
+    text = transcript_text.lower()
+    for end, phrase in _INCIDENT_AUTOMATON.iter(text):
+        start = end - len(phrase) + 1
+        # Only whole words count, so "begun" is not a hit for "gun"
+        if (start == 0 or not text[start - 1].isalnum()) and (end + 1 == len(text) or not text[end + 1].isalnum()):
+            return True
+    return False
+
+def _missing_completion_error():
+    return RuntimeError("No completion returned for this chunk in the batch response")
+
+def _batch_completions(response, expected):
+    completions = list(response.batch)
+    if len(completions) != expected:
+        print(f"Warning: batch response has {len(completions)} completions for {expected} prompts")
+    # Pad short batches with None so every chunk still gets its own result; extras have no chunk to go to
+    return completions[:expected] + [None] * (expected - len(completions))
+
+def analyze_transcripts(llm_client, model_id, transcripts, llm_client_settings=None):
+    if not transcripts:
+        return []
+
+    # One request for every chunk lets the server prefill the prompts together
+    print(f"Analyzing {len(transcripts)} transcripts in one batch")
+    try:
+        response = llm_client.inference.batch_chat_completion(
+            model_id=model_id,
+            messages_batch=[_classify_messages(transcript_text) for _, transcript_text, _ in transcripts],
+            sampling_params=CLASSIFY_SAMPLING_PARAMS
+        )
+    except Exception as e:
+        # Not every provider implements batch inference; keep several single requests in flight instead
+        print(f"Batch inference unavailable ({e}), sending {len(transcripts)} requests concurrently")
+        # The async client can only mirror the sync one when the settings it was built from are known
+        if AsyncLlamaStackClient is not None and llm_client_settings is not None:
+            return asyncio.run(_analyze_transcripts_async(llm_client_settings, model_id, transcripts))
+        with ThreadPoolExecutor(max_workers=LLM_CONCURRENCY) as executor:
+            futures = [
+                executor.submit(analyze_transcript, llm_client, model_id, transcript_text, start_time)
+                for _, transcript_text, start_time in transcripts
+            ]
+            return [future.result() for future in futures]
+
+    results = [None] * len(transcripts)
+    to_summarize = []  # (index, transcript_text, start_time, verdict)
+    for idx, ((_, transcript_text, start_time), completion) in enumerate(
+        zip(transcripts, _batch_completions(response, len(transcripts)))
+    ):
+        if completion is None:
+            results[idx] = _analysis_error(start_time, _missing_completion_error())
+            continue
+        try:
+            verdict = _classification(completion)
+        except Exception as e:
+            results[idx] = _analysis_error(start_time, e)
+            continue
+        if verdict is False:
+            results[idx] = _quiet_chunk(start_time)
+        else:
+            to_summarize.append((idx, transcript_text, start_time, verdict))
+
+    # Only chunks the classifier did not rule out get a full summary
+    if to_summarize:
+        print(f"Summarizing {len(to_summarize)} flagged transcripts")
+        try:
+            response = llm_client.inference.batch_chat_completion(
+                model_id=model_id,
+                messages_batch=[_build_messages(transcript_text) for _, transcript_text, _, _ in to_summarize]
+            )
+            completions = _batch_completions(response, len(to_summarize))
+        except Exception as e:
+            completions = [e] * len(to_summarize)
+
+        for (idx, _, start_time, verdict), completion in zip(to_summarize, completions):
+            if completion is None:
+                completion = _missing_completion_error()
+            if isinstance(completion, Exception):
+                results[idx] = _analysis_error(start_time, completion)
+                continue
+            try:
+                results[idx] = _incident_from_completion(completion, start_time, verdict)
+            except Exception as e:
+                results[idx] = _analysis_error(start_time, e)
+
+    return results
 
-def analyze_video(video_path):
+def analyze_video(video_path, whisper_model=None, llm_client=None, llm_client_settings=None):
     if not os.path.exists(video_path):
         raise FileNotFoundError(f"File '{video_path}' does not exist")
 
-    print("Connecting to Llama Stack...")
-    llm_client = create_llama_client()
+    if llm_client is None:
+        print("Connecting to Llama Stack...")
+        llm_client_settings = llm_client_settings or llama_client_settings()
+        llm_client = create_llama_client(llm_client_settings)
     model_id = os.getenv("INFERENCE_MODEL")
     if not model_id:
         raise RuntimeError("INFERENCE_MODEL not set in .env")
     print(f"Using model: {model_id}")
 
-    audio_chunks, temp_dir, video_duration = extract_chunks(video_path)
-    transcripts = transcribe_chunks(audio_chunks)
+    transcripts, video_duration = transcribe_video(video_path, whisper_model)
 
-    results = []
-
-    for audio_path, transcript_text, start_time in transcripts:
-        chunk_name = os.path.basename(audio_path)
-
-        # Save transcript (optional, useful for debugging)
-        transcript_file = os.path.join(temp_dir, f"{os.path.splitext(chunk_name)[0]}_transcript.txt")
-        with open(transcript_file, 'w') as f:
-            f.write(transcript_text)
+    temp_root = Path("temp")
+    temp_root.mkdir(exist_ok=True)
+    temp_dir = tempfile.mkdtemp(prefix="chunks_", dir=temp_root)
+    print(f"Using temporary directory: {Path(temp_dir).resolve()}")
 
+    try:
+        # Save transcripts (optional, useful for debugging)
+        with open(os.path.join(temp_dir, "transcripts.jsonl"), 'w') as f:
+            for chunk_name, transcript_text, start_time in transcripts:
+                f.write(json.dumps({"chunk": chunk_name, "start": start_time, "text": transcript_text}) + "\n")
+
+        # Only chunks with a lexicon hit are worth an LLM call
+        flags = [mentions_incident(transcript_text) for _, transcript_text, _ in transcripts]
+        skipped = flags.count(False)
+        if transcripts:
+            print(f"Keyword filter skipped {skipped}/{len(transcripts)} chunks ({skipped / len(transcripts):.0%})")
+
+        analyzed = iter(analyze_transcripts(
+            llm_client, model_id, [transcript for transcript, flag in zip(transcripts, flags) if flag],
+            llm_client_settings
+        ))
+        results = [
+            next(analyzed) if flag else _quiet_chunk(start_time)
+            for (_, _, start_time), flag in zip(transcripts, flags)
+        ]
+
+        for (_, _, start_time), incident_data in zip(transcripts, results):
+            chunk_end_time = min(start_time + CHUNK_DURATION, video_duration)
+
+            incident_data.update({
+                "start_time_seconds": start_time,
+                "end_time_seconds": chunk_end_time,
+                "start_time_minsec": f"{start_time // 60:02d}:{start_time % 60:02d}",
+                "end_time_minsec": f"{chunk_end_time // 60:02d}:{chunk_end_time % 60:02d}"
+            })
+    finally:
+        # Clean up
         try:
-            incident_data = analyze_transcript(llm_client, model_id, transcript_text, start_time)
+            shutil.rmtree(temp_dir)
         except Exception as e:
-            incident_data = {
-                "timestamp": start_time,
-                "summary": f"LLM analysis failed: {str(e)}"
-            }
-
-        chunk_end_time = min(start_time + CHUNK_DURATION, video_duration)
-
-        incident_data.update({
-            "start_time_seconds": start_time,
-            "end_time_seconds": chunk_end_time,
-            "start_time_minsec": f"{start_time // 60:02d}:{start_time % 60:02d}",
-            "end_time_minsec": f"{chunk_end_time // 60:02d}:{chunk_end_time % 60:02d}"
-        })
-
-        results.append(incident_data)
-
-    # Clean up
-    try:
-        shutil.rmtree(temp_dir)
-    except Exception as e:
-        print(f"Warning: Failed to clean up temporary directory: {e}")
+            print(f"Warning: Failed to clean up temporary directory: {e}")
 
     return results
 
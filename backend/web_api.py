@@ -1,11 +1,42 @@
 from flask import Flask, request, jsonify, send_from_directory
+from concurrent.futures import ThreadPoolExecutor
 import tempfile
 import os
+import threading
+import time
 import uuid
-from footage_analysis import analyze_video
+from footage_analysis import analyze_video, create_llama_client, llama_client_settings, load_whisper_model
 
 app = Flask(__name__, static_folder="frontend", static_url_path="")
 
+# Loaded once at startup and shared by every request
+WHISPER_MODEL = load_whisper_model()
+LLM_CLIENT_SETTINGS = llama_client_settings()
+LLM_CLIENT = create_llama_client(LLM_CLIENT_SETTINGS)
+
+# Videos are analyzed in the background so uploads return immediately. Jobs run on
+# threads rather than processes so they all share the single resident copy of the weights.
+EXECUTOR = ThreadPoolExecutor(max_workers=int(os.getenv("ANALYSIS_WORKERS", "2")))
+JOB_TTL = int(os.getenv("JOB_TTL_SECONDS", "3600"))  # finished jobs nobody fetched are dropped after this
+JOBS = {}  # job_id -> {"future": Future, "finished_at": float or None}
+JOBS_LOCK = threading.Lock()
+
+def _finish_job(job_id, video_path):
+    try:
+        os.remove(video_path)
+    except OSError as e:
+        print(f"Warning: Failed to remove uploaded video: {e}")
+
+    with JOBS_LOCK:
+        if job_id in JOBS:
+            JOBS[job_id]["finished_at"] = time.time()
+
+def _evict_expired_jobs():
+    cutoff = time.time() - JOB_TTL
+    with JOBS_LOCK:
+        for job_id in [job_id for job_id, job in JOBS.items() if job["finished_at"] and job["finished_at"] < cutoff]:
+            del JOBS[job_id]
+
 @app.route("/")
 def index():
     return app.send_static_file("index.html")
@@ -16,14 +47,40 @@ def analyze():
         return jsonify({"error": "No video file provided"}), 400
 
     video = request.files["video"]
-    temp_path = os.path.join(tempfile.gettempdir(), f"{uuid.uuid4()}.mp4")
+    job_id = str(uuid.uuid4())
+    temp_path = os.path.join(tempfile.gettempdir(), f"{job_id}.mp4")
     video.save(temp_path)
 
+    _evict_expired_jobs()
+    future = EXECUTOR.submit(
+        analyze_video, temp_path,
+        whisper_model=WHISPER_MODEL, llm_client=LLM_CLIENT, llm_client_settings=LLM_CLIENT_SETTINGS
+    )
+    with JOBS_LOCK:
+        JOBS[job_id] = {"future": future, "finished_at": None}
+    future.add_done_callback(lambda _: _finish_job(job_id, temp_path))
+    return jsonify({"job_id": job_id}), 202
+
+@app.route("/analyze/<job_id>", methods=["GET"])
+def analyze_status(job_id):
+    _evict_expired_jobs()
+    with JOBS_LOCK:
+        job = JOBS.get(job_id)
+        if job is None:
+            return jsonify({"error": f"Unknown job '{job_id}'"}), 404
+
+        future = job["future"]
+        if not future.done():
+            return jsonify({"status": "running"})
+
+        # Results are handed out once, then the job is forgotten
+        del JOBS[job_id]
+
     try:
-        results = analyze_video(temp_path)
-        return jsonify(results)
+        results = future.result()
+        return jsonify({"status": "done", "results": results})
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return jsonify({"status": "failed", "error": str(e)}), 500
     
 
     